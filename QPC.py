@@ -1,9 +1,10 @@
 import numpy as np
 import os
+import sys
 import json
 
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.neural_network import MLPClassifier
+# The vectorizer and the classifier are sklearn objects, sklearn is imported
+# when they are unpickled.
 import pickle
 
 class QPC_model:
@@ -23,8 +24,10 @@ class QPC_model:
     def model(self):
         '''
         Method for loading word vectorizer and neural network.
+        The model is only loaded from disk once.
         '''
-        self.cv, self.mlpc = self._load_model(self.conf)
+        if self.mlpc is None:
+            self.cv, self.mlpc = self._load_model(self.conf)
 
 
     def predict(self, query_list):
@@ -50,4 +53,10 @@ class QPC_model:
             cv = pickle.load(f)
         with open('qpcmlpc-' + conf + '.sav','rb') as f:
             mlpc = pickle.load(f)
-        return (cv, mlpc)
\ No newline at end of file
+        return (cv, mlpc)
+
+
+if __name__ == "__main__":
+    categorizer = QPC_model()
+    pred = categorizer.predict([{'id': 'query', 'question': ' '.join(sys.argv[1:])}])
+    print(categorizer.classes[pred['query']])
\ No newline at end of file
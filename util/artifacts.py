@@ -0,0 +1,103 @@
+#%%
+import pickle
+
+from util.io import get_data_path, load_dict_from_json
+
+_LOADERS = {}
+_CACHE = {}
+
+
+def register(name, loader):
+    """Registers a loader for an artefact; it is only called on first use."""
+    _LOADERS[name] = loader
+    _CACHE.pop(name, None)
+
+
+def get(name):
+    """Returns an artefact, loading and memoising it on first use."""
+    if name not in _CACHE:
+        if name not in _LOADERS:
+            raise KeyError(f'Unknown artefact \'{name}\'')
+        _CACHE[name] = _LOADERS[name]()
+    return _CACHE[name]
+
+
+def is_loaded(name):
+    return name in _CACHE
+
+
+def clear(name=None):
+    """Drops a memoised artefact, or all of them, so they are reloaded."""
+    if name is None:
+        _CACHE.clear()
+    else:
+        _CACHE.pop(name, None)
+
+
+def clear_feature_table(table):
+    """Drops the artefacts loaded from a feature table after it is rewritten."""
+    for name, source in FEATURE_TABLES.items():
+        if source == table:
+            clear(name)
+
+
+def load_pickle(filename):
+    with open(get_data_path(filename), 'rb') as f:
+        return pickle.load(f)
+
+
+#%% LOADERS
+def _type_weights():
+    from util.parse_dbpedia import get_type_weights
+    return get_type_weights()
+
+
+def _instance_types():
+    from util.parse_dbpedia import get_all_instance_types
+    return get_all_instance_types(True)
+
+
+def _ontology():
+    from util.parse_dbpedia import get_ontology
+    return get_ontology()
+
+
+# Artefacts backed by a feature table, see `util.features`.
+FEATURE_TABLES = {
+    'family': 'type_hierarchy',
+    'type_length': 'type_length',
+    'type_label_idf': 'type_label_idf',
+}
+
+
+def _feature_table(name):
+
+    def load():
+        from util.features import load_feature_table
+        return load_feature_table(name)
+
+    return load
+
+
+def _type_hierarchy():
+    from util.features import TYPE_HIERARCHY
+    from smart_dataset.evaluation.dbpedia.evaluate import load_type_hierarchy
+    return load_type_hierarchy(TYPE_HIERARCHY)
+
+
+def _qpc():
+    from QPC import QPC_model
+    model = QPC_model()
+    model.model()
+    return model
+
+
+register('type_weight', _type_weights)
+register('instance_types', _instance_types)
+register('ontology', _ontology)
+register('type_hierarchy', _type_hierarchy)
+for name, table in FEATURE_TABLES.items():
+    register(name, _feature_table(table))
+register('q_ids', lambda: load_dict_from_json('q_id_list.json'))
+register('qt_features', lambda: load_pickle('Q_T_features'))
+register('qpc', _qpc)
@@ -0,0 +1,110 @@
+#%%
+"""Startup benchmark guarding against slow imports.
+
+Run from the repository root, optionally failing when a budget is exceeded:
+
+    python -m util.bench_startup --check
+"""
+import argparse, os, re, subprocess, sys, time
+
+# Import budgets in milliseconds, and the heavy dependencies that must not be
+# pulled in by importing the module.
+IMPORT_BUDGETS = {
+    'util.es': (250, ['elasticsearch', 'nltk', 'sklearn']),
+    'util.artifacts': (100, ['nltk', 'numpy', 'sklearn']),
+    'util.candidates': (250, ['elasticsearch', 'nltk', 'sklearn']),
+    'QPC': (500, ['sklearn']),
+}
+FIRST_PREDICTION_BUDGET = 5.0  # seconds
+QPC_MODEL_FILES = ('qpccv-tc1.sav', 'qpcmlpc-tc1.sav')
+QUESTION = 'Who is the heaviest player of the Chicago Bulls?'
+
+
+def measure_import(module):
+    """Imports a module in a fresh interpreter with `-X importtime`.
+
+    Returns:
+        tuple: Cumulative import time in ms, the slowest imports as
+            (module, self time in ms) and the set of loaded modules.
+    """
+    res = subprocess.run([
+        sys.executable, '-X', 'importtime', '-c',
+        f'import sys, {module}; print(" ".join(sys.modules))'
+    ],
+                         capture_output=True,
+                         text=True,
+                         check=True)
+
+    self_time, cumulative = {}, {}
+    for line in res.stderr.splitlines():
+        m = re.match(r'import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)', line)
+        if m:
+            self_time[m.group(3)] = int(m.group(1)) / 1000
+            cumulative[m.group(3)] = int(m.group(2)) / 1000
+
+    slowest = sorted(self_time.items(), key=lambda x: x[1], reverse=True)[:5]
+    return cumulative.get(module, 0), slowest, set(res.stdout.split())
+
+
+def measure_first_prediction(question=QUESTION):
+    """Time for a one-query CLI invocation of the category classifier.
+
+    Raises:
+        RuntimeError: If the invocation fails, with its stderr.
+    """
+    start = time.perf_counter()
+    res = subprocess.run([sys.executable, 'QPC.py', question],
+                         capture_output=True,
+                         text=True)
+    if res.returncode != 0:
+        raise RuntimeError(res.stderr.strip())
+    return time.perf_counter() - start
+
+
+def run(check=False):
+    failures = []
+    print('{:<18} {:>10} {:>10}  {}'.format('module', 'time [ms]',
+                                            'budget', 'slowest imports'))
+    for module, (budget, lazy) in IMPORT_BUDGETS.items():
+        elapsed, slowest, loaded = measure_import(module)
+        print('{:<18} {:>10.1f} {:>10}  {}'.format(
+            module, elapsed, budget,
+            ', '.join(f'{m} ({t:.1f})' for m, t in slowest)))
+        if elapsed > budget:
+            failures.append(f'{module} took {elapsed:.1f} ms')
+        leaked = [m for m in lazy if m in loaded]
+        if leaked:
+            failures.append(f'{module} imports {", ".join(leaked)}')
+
+    missing = [f for f in QPC_MODEL_FILES if not os.path.exists(f)]
+    if missing:
+        if check:
+            failures.append(f'QPC model missing ({", ".join(missing)}), '
+                            'first prediction not measured')
+        else:
+            print('Time to first prediction: guard skipped, QPC model '
+                  f'missing ({", ".join(missing)}).')
+    else:
+        try:
+            elapsed = measure_first_prediction()
+        except RuntimeError as e:
+            failures.append(f'first prediction failed:\n{e}')
+        else:
+            print(f'Time to first prediction: {elapsed:.2f} s '
+                  f'(budget {FIRST_PREDICTION_BUDGET} s)')
+            if elapsed > FIRST_PREDICTION_BUDGET:
+                failures.append(f'first prediction took {elapsed:.2f} s')
+
+    for failure in failures:
+        print('FAIL:', failure)
+    if check and failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--check',
+                        action='store_true',
+                        help='exit with an error if a budget is exceeded or '
+                        'the QPC model is missing')
+    run(parser.parse_args().check)
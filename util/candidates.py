@@ -0,0 +1,170 @@
+#%%
+import time
+from collections import defaultdict
+
+from util import artifacts
+
+
+#%% FUSION
+def reciprocal_rank_fusion(runs, qid, k=60):
+    """Fuses the baseline runs for a query with reciprocal-rank fusion.
+
+    Args:
+        runs (list): Baseline runs, each a dict mapping query IDs to
+            {type: score} dicts (see `get_baseline` in the Model Notebook).
+        qid (str): Query ID.
+        k (int, optional): RRF rank constant. Defaults to 60.
+
+    Returns:
+        list: (type, fused score) tuples sorted by fused score.
+    """
+    scores = defaultdict(float)
+    for run in runs:
+        ranked = sorted(run.get(qid, {}).items(),
+                        key=lambda x: x[1],
+                        reverse=True)
+        for rank, (t, _) in enumerate(ranked, 1):
+            scores[t] += 1 / (k + rank)
+
+    return sorted(scores.items(), key=lambda x: x[1], reverse=True)
+
+
+#%% CANDIDATE SELECTION
+def add_ancestors(types, ontology):
+    """Extends a list of types with their ontology ancestors.
+
+    Ancestors are appended after the original types, in order of first
+    appearance, so the input ordering is preserved.
+    """
+    candidates = list(types)
+    seen = set(candidates)
+    for t in types:
+        for ancestor in ontology.get(t, {}).get('path', []):
+            if ancestor not in seen:
+                seen.add(ancestor)
+                candidates.append(ancestor)
+    return candidates
+
+
+def select_candidates(runs, qid, n=None, ancestors=True, ontology=None, k=60):
+    """Selects the candidate types for which LTR features are extracted.
+
+    Args:
+        runs (list): Baseline runs, see `reciprocal_rank_fusion`.
+        qid (str): Query ID.
+        n (int, optional): Number of fused types to keep. Defaults to None,
+            which keeps every type returned by any of the runs and nothing
+            else, the unpruned candidates the LTR models were trained on.
+        ancestors (bool, optional): Also keep the ontology ancestors of the
+            selected types when pruning. Defaults to True.
+        ontology (dict, optional): Ontology as returned by `get_ontology`.
+            Taken from the artefact registry if not given.
+        k (int, optional): RRF rank constant. Defaults to 60.
+
+    Returns:
+        list: Candidate types, best fused candidates first.
+    """
+    fused = reciprocal_rank_fusion(runs, qid, k)
+    if n is None:
+        return [t for t, _ in fused]
+
+    candidates = [t for t, _ in fused[:n]]
+    if ancestors:
+        candidates = add_ancestors(candidates, ontology
+                                   or artifacts.get('ontology'))
+    return candidates
+
+
+#%% TUNING
+def pruning_report(runs,
+                   queries,
+                   n_list=(10, 20, 50, 100),
+                   ancestors=True,
+                   extract=None,
+                   k=60):
+    """Measures recall lost and speedup of candidate pruning for several N.
+
+    Recall is the fraction of ground truth types that end up among the
+    candidates, and is compared against the unpruned candidate pool, which
+    includes the ontology ancestors if `ancestors` is set. The
+    speedup is the reduction in the number of (query, type) pairs that need
+    features. If `extract` is given, it is called as `extract(qid, t)` for
+    every pair and the measured speedup is reported as well. It is called
+    once before timing, so lazily loaded artefacts do not count against
+    the first pass.
+
+    Args:
+        runs (list): Baseline runs, see `reciprocal_rank_fusion`.
+        queries (list): Queries with 'id', 'category' and 'type' keys.
+        n_list (tuple, optional): Values of N to evaluate.
+        ancestors (bool, optional): See `select_candidates`.
+        extract (callable, optional): Feature extractor to time.
+        k (int, optional): RRF rank constant. Defaults to 60.
+
+    Returns:
+        dict: Statistics for each N, with None denoting no pruning.
+    """
+    ontology = artifacts.get('ontology') if ancestors else None
+    queries = [
+        q for q in queries
+        if q['category'] == 'resource' and q['type'] and any(
+            q['id'] in run for run in runs)
+    ]
+
+    if extract is not None:
+        for query in queries:
+            candidates = select_candidates(runs, query['id'], k=k)
+            if candidates:
+                extract(query['id'], candidates[0])
+                break
+
+    report = {}
+    for n in (None, *n_list):
+        num_pairs, num_relevant, num_found, elapsed = 0, 0, 0, 0.0
+        for query in queries:
+            candidates = select_candidates(runs, query['id'], n, ancestors,
+                                           ontology, k)
+            if n is None and ancestors:
+                candidates = add_ancestors(candidates, ontology)
+            num_pairs += len(candidates)
+            num_relevant += len(query['type'])
+            num_found += len(set(query['type']).intersection(candidates))
+            if extract is not None:
+                start = time.perf_counter()
+                for t in candidates:
+                    extract(query['id'], t)
+                elapsed += time.perf_counter() - start
+
+        report[n] = {
+            'pairs': num_pairs,
+            'avg_candidates': num_pairs / max(len(queries), 1),
+            'recall': num_found / max(num_relevant, 1),
+            'extraction_time': elapsed if extract is not None else None,
+        }
+
+    full = report[None]
+    for stats in report.values():
+        stats['recall_lost'] = full['recall'] - stats['recall']
+        stats['speedup'] = full['pairs'] / max(stats['pairs'], 1)
+        if extract is not None:
+            stats['measured_speedup'] = full['extraction_time'] / max(
+                stats['extraction_time'], 1e-9)
+
+    return report
+
+
+def print_pruning_report(report):
+    measured = all('measured_speedup' in stats for stats in report.values())
+    header = '{:>6} {:>10} {:>8} {:>12} {:>8}'.format(
+        'N', 'candidates', 'recall', 'recall lost', 'speedup')
+    if measured:
+        header += ' {:>11} {:>9}'.format('extract [s]', 'measured')
+    print(header)
+    for n, stats in report.items():
+        line = '{:>6} {:>10.1f} {:>8.4f} {:>12.4f} {:>7.2f}x'.format(
+            'all' if n is None else n, stats['avg_candidates'],
+            stats['recall'], stats['recall_lost'], stats['speedup'])
+        if measured:
+            line += ' {:>11.3f} {:>8.2f}x'.format(stats['extraction_time'],
+                                                 stats['measured_speedup'])
+        print(line)
@@ -1,11 +1,10 @@
 #%%
 import os
 from collections import defaultdict
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import parallel_bulk
 
-from util.parse_dbpedia import get_TC_documents, get_EC_documents, get_type_weights, get_all_instance_types
+from util.parse_dbpedia import get_TC_documents, get_EC_documents, get_type_weights
 from util.io import load_dict_from_json, save_dict_to_json
+from util import artifacts, instrumentation
 
 
 class ES:
@@ -20,6 +19,7 @@ class ES:
         self._settings['settings'] = getattr(
             self, f'get_{similarity.lower()}_settings')()
 
+        from elasticsearch import Elasticsearch
         self.es = Elasticsearch(timeout=120)
         #print(self.es.info())
 
@@ -80,28 +80,32 @@ class ES:
         self.es.indices.create(self._index_name, self._settings)
 
     def data_from_generator(self, doc):
-        num_docs = len(doc) // 10
-        for i, (doc_id, body) in enumerate(doc.items()):
+        for i, (doc_id, body) in enumerate(doc.items(), 1):
             yield {'_index': self._index_name, '_id': doc_id, '_source': body}
-            if i % num_docs == 0:
-                print('{}% done'.format((i // num_docs) * 10))
+            instrumentation.count('docs_generated')
+            instrumentation.progress('index_EC', i, len(doc))
 
     def _index_EC(self, documents):
-        for success, info in parallel_bulk(self.es,
-                                           self.data_from_generator(documents),
-                                           thread_count=12,
-                                           chunk_size=5000,
-                                           max_chunk_bytes=104857600,
-                                           queue_size=6):
-            if not success:
-                print('A document failed:', info)
+        from elasticsearch.helpers import parallel_bulk
+        with instrumentation.timer('index_EC') as stage:
+            for success, info in parallel_bulk(
+                    self.es,
+                    self.data_from_generator(documents),
+                    thread_count=12,
+                    chunk_size=5000,
+                    max_chunk_bytes=104857600,
+                    queue_size=6):
+                stage.add()
+                if not success:
+                    print('A document failed:', info)
 
     def _index_TC(self, documents):
-        num_docs = len(documents) // 10
-        for i, (did, body) in enumerate(documents.items()):
-            self.es.index(self._index_name, body=body, id=did)
-            if i % num_docs == 0:
-                print('{}% done'.format((i // num_docs) * 10))
+        with instrumentation.timer('index_TC') as stage:
+            for i, (did, body) in enumerate(documents.items(), 1):
+                self.es.index(self._index_name, body=body, id=did)
+                stage.add()
+                instrumentation.count('es_requests')
+                instrumentation.progress('index_TC', i, len(documents))
 
     def reindex(self, doc_body='short', ancestors=False):
         print('Indexing model {} - {}'.format(self.model, self.similarity))
@@ -118,6 +122,7 @@ class ES:
             self._index_TC(documents)
             # self._index_TC({k: v for k, v in list(documents.items())[:20]})
 
+    @instrumentation.timed('analyze_query')
     def analyze_query(self, query, field='body'):
         """Analyzes a query with respect to the relevant index.
         
@@ -130,6 +135,7 @@ class ES:
         """
         tokens = self.es.indices.analyze(index=self._index_name,
                                          body={'text': query})['tokens']
+        instrumentation.count('es_requests', 1 + len(tokens))
         query_terms = []
         for t in sorted(tokens, key=lambda x: x['position']):
             ## Use a boolean query to find at least one document that contains the term.
@@ -149,6 +155,7 @@ class ES:
             query_terms.append(t['token'])
         return query_terms
 
+    @instrumentation.timed('baseline_EC_retrieval')
     def baseline_EC_retrieval(self, queries, k=100):
         """Performs baseline retrival on index.
         """
@@ -173,12 +180,14 @@ class ES:
                 'size': k
             })
         res = self.es.msearch(index=self._index_name, body=body)['responses']
+        instrumentation.count('es_requests')
 
         return {
             qid: [(doc['_id'], doc['_score']) for doc in hits['hits']['hits']
                  ] for qid, hits in zip(ids, res)
         }
 
+    @instrumentation.timed('baseline_TC_retrieval')
     def baseline_TC_retrieval(self, queries, k=100):
         """Performs baseline retrival on index.
         """
@@ -204,6 +213,7 @@ class ES:
                 })
             res = self.es.msearch(index=self._index_name,
                                   body=body)['responses']
+            instrumentation.count('es_requests')
 
             scores = defaultdict(int)
             for hits in res:
@@ -243,18 +253,20 @@ class ES:
         Returns:
             dict: Type scores
         """
-        type_weights = get_type_weights()
-        entity_types = get_all_instance_types(True)
+        type_weights = artifacts.get('type_weight')
+        entity_types = artifacts.get('instance_types')
         system_output = {}
-        for qid, res in results.items():
-            scores = defaultdict(int)
-            for entity, score in res[:k]:
-                for t in entity_types[entity]:
-                    scores[t] += score / type_weights[t]
-
-            system_output[qid] = sorted(scores.items(),
-                                        key=lambda x: x[1],
-                                        reverse=True)
+        with instrumentation.timer('aggregate_EC_scores') as stage:
+            for qid, res in results.items():
+                scores = defaultdict(int)
+                for entity, score in res[:k]:
+                    for t in entity_types[entity]:
+                        scores[t] += score / type_weights[t]
+
+                system_output[qid] = sorted(scores.items(),
+                                            key=lambda x: x[1],
+                                            reverse=True)
+                stage.add()
         return system_output
 
     def get_baseline_TC_scores(self, results, k=None):
@@ -0,0 +1,531 @@
+#%%
+import hashlib, json, os, re, string
+from collections import Counter, defaultdict
+
+import numpy as np
+from scipy import sparse
+
+from util import artifacts, instrumentation
+from util.io import get_data_path, load_dict_from_json, save_dict_to_json
+from util.parse_dbpedia import get_stopwords, get_TC_documents
+
+FEATURE_DIR = 'features'
+SCHEMA_FILE = os.path.join(FEATURE_DIR, 'schema.json')
+TYPE_HIERARCHY = os.path.join('smart_dataset', 'evaluation', 'dbpedia',
+                              'dbpedia_types.tsv')
+DATASETS = ('train', 'validation', 'test')
+
+# Bump when `compute_index_statistics` changes.
+INDEX_STATISTICS_VERSION = 1
+
+IDF_COLUMNS = [('query_length', 'int64'), ('query_sum_idf', 'float64'),
+               ('query_max_idf', 'float64'), ('query_avg_idf', 'float64')]
+
+
+#%% PREPROCESS TEXT
+def preprocess_terms(text):
+    """Splits text into lowercase, ascii, alphabetic, non-stopword terms."""
+    table = str.maketrans('', '', string.punctuation)
+    stopwords = get_stopwords()
+    terms = []
+    for word in re.split(r'[\s*\n]', text.lower()):
+        word = word.translate(table)
+        if word.isalpha() and word.isascii() and word not in stopwords:
+            terms.append(word)
+    return terms
+
+
+def split_type_label(type_id):
+    """Turns a type ID such as 'dbo:PopulatedPlace' into its label terms."""
+    return [w.lower() for w in re.findall('([A-Z][a-z]*)', type_id[4:])]
+
+
+#%% INPUTS
+def load_type_hierarchy(path=TYPE_HIERARCHY):
+    """Loads the SMART type hierarchy as {type: {'depth', 'parent'}}."""
+    hierarchy = {}
+    with open(path, 'r') as f:
+        next(f)
+        for line in f:
+            if not line.strip():
+                continue
+            t, depth, parent = line.split()[:3]
+            hierarchy[t] = {'depth': int(depth), 'parent': parent}
+    return hierarchy
+
+
+def get_children(hierarchy):
+    children = defaultdict(list)
+    for t, node in hierarchy.items():
+        children[node['parent']].append(t)
+    return children
+
+
+def load_queries():
+    queries = []
+    for dataset in DATASETS:
+        queries.extend(load_dict_from_json(f'{dataset}_set_fixed.json') or [])
+    return queries
+
+
+def get_fingerprints(paths):
+    """Cheap change detector for input files: size and modification time."""
+    fingerprints = {}
+    for path in paths:
+        stat = os.stat(path) if os.path.exists(path) else None
+        fingerprints[os.path.relpath(path)] = (
+            f'{stat.st_size}-{stat.st_mtime_ns}' if stat else None)
+    return fingerprints
+
+
+def get_spec_fingerprint(spec):
+    """Hash of a table's key, column schema and compute version."""
+    definition = {k: spec.get(k) for k in ('key', 'columns', 'version')}
+    return hashlib.sha1(
+        json.dumps(definition, sort_keys=True).encode()).hexdigest()
+
+
+#%% INDEX STATISTICS
+def get_index_name(doc_body='short', ancestors=True):
+    return 'TC{}{}'.format('_' + doc_body if doc_body else '',
+                           '_all' if ancestors else '')
+
+
+def fill_empty_documents(counts, doc_ids, hierarchy):
+    """Gives types without a body the summed term counts of their children,
+    or of their siblings if none of the children have a body.
+    """
+    index = {t: i for i, t in enumerate(doc_ids)}
+    children = get_children(hierarchy)
+    nonempty = counts.getnnz(axis=1) > 0
+
+    rows, cols = [], []
+    for r in np.flatnonzero(~nonempty):
+        t = doc_ids[r]
+        members = [index[c] for c in children[t] if c in index]
+        if not nonempty[members].any():
+            parent = hierarchy.get(t, {}).get('parent')
+            members = [index[s] for s in children[parent] if s in index]
+        rows.extend([r] * len(members))
+        cols.extend(members)
+
+    aggregate = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                                  shape=(len(doc_ids), len(doc_ids)))
+    return counts + (aggregate @ counts).astype(counts.dtype)
+
+
+def compute_index_statistics(documents, hierarchy):
+    """Computes document frequencies and document lengths of a TC index.
+
+    Args:
+        documents (dict): TC documents as returned by `get_TC_documents`.
+        hierarchy (dict): Type hierarchy, see `load_type_hierarchy`.
+
+    Returns:
+        dict: Arrays 'doc_ids', 'doc_length', 'vocabulary', 'doc_freq' and
+            the scalar 'num_docs'.
+    """
+    doc_ids = list(documents) + [t for t in hierarchy if t not in documents]
+    vocabulary = {}
+    rows, cols, data = [], [], []
+    for r, doc_id in enumerate(doc_ids):
+        body = documents.get(doc_id, {}).get('body', '')
+        for term, count in Counter(preprocess_terms(body)).items():
+            rows.append(r)
+            cols.append(vocabulary.setdefault(term, len(vocabulary)))
+            data.append(count)
+
+    counts = sparse.csr_matrix((data, (rows, cols)),
+                               shape=(len(doc_ids), len(vocabulary)),
+                               dtype=np.int64)
+    counts = fill_empty_documents(counts, doc_ids, hierarchy)
+
+    return {
+        'doc_ids': np.array(doc_ids, dtype=str),
+        'doc_length': np.asarray(counts.sum(axis=1)).ravel(),
+        'vocabulary': np.array(list(vocabulary), dtype=str),
+        'doc_freq': counts.getnnz(axis=0).astype(np.int64),
+        'num_docs': np.int64((counts.getnnz(axis=1) > 0).sum()),
+    }
+
+
+def load_index_statistics(doc_body='short', ancestors=True):
+    path = get_data_path(
+        os.path.join(FEATURE_DIR, get_index_name(doc_body, ancestors) + '.npz'))
+    with np.load(path, allow_pickle=False) as stats:
+        return {k: stats[k] for k in stats.files}
+
+
+#%% FEATURES
+def compute_type_hierarchy(hierarchy):
+    types = list(hierarchy)
+    children = get_children(hierarchy)
+    return types, {
+        'depth': [hierarchy[t]['depth'] for t in types],
+        'num_siblings': [len(children[hierarchy[t]['parent']]) for t in types],
+        'num_children': [len(children[t]) for t in types],
+    }
+
+
+def compute_type_length(stats):
+    return list(stats['doc_ids']), {'doc_length_body': stats['doc_length']}
+
+
+def compute_idf_features(term_lists, stats):
+    """Computes length and sum/max/avg IDF of many term lists at once.
+
+    Terms that do not occur in the index get the IDF of a term that occurs
+    in a single document.
+
+    Args:
+        term_lists (list): Lists of terms, one per row.
+        stats (dict): Index statistics, see `compute_index_statistics`.
+
+    Returns:
+        dict: One array per column in `IDF_COLUMNS`.
+    """
+    vocabulary = {t: i for i, t in enumerate(stats['vocabulary'])}
+    unseen = len(vocabulary)
+    idf = np.log(stats['num_docs'] / np.maximum(stats['doc_freq'], 1))
+    idf = np.append(idf, np.log(stats['num_docs']))
+
+    rows = [r for r, terms in enumerate(term_lists) for _ in terms]
+    cols = [vocabulary.get(t, unseen) for terms in term_lists for t in terms]
+    counts = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)),
+                               shape=(len(term_lists), len(idf)))
+
+    length = np.asarray(counts.sum(axis=1)).ravel()
+    sum_idf = counts @ idf
+    max_idf = counts.sign().multiply(idf).tocsr().max(axis=1).toarray().ravel()
+    avg_idf = np.divide(sum_idf,
+                        length,
+                        out=np.zeros_like(sum_idf),
+                        where=length > 0)
+    return dict(zip([c for c, _ in IDF_COLUMNS],
+                    [length, sum_idf, max_idf, avg_idf]))
+
+
+def compute_type_label_idf(stats):
+    types = list(stats['doc_ids'])
+    return types, compute_idf_features([split_type_label(t) for t in types],
+                                       stats)
+
+
+def compute_query_idf(stats, queries):
+    term_lists = [preprocess_terms(q['question'] or '') for q in queries]
+    return [q['id'] for q in queries], compute_idf_features(term_lists, stats)
+
+
+def get_feature_specs():
+    """Feature tables, their key, column schema and inputs.
+
+    The column order in the schema is the order in which the features are
+    used by the model. Bump a table's 'version' whenever its compute
+    function changes; together with the columns it is part of the
+    fingerprint that decides whether the table is rebuilt.
+    """
+    stats_all = get_data_path(os.path.join(FEATURE_DIR, 'TC_short_all.npz'))
+    stats = get_data_path(os.path.join(FEATURE_DIR, 'TC_short.npz'))
+    datasets = [get_data_path(f'{d}_set_fixed.json') for d in DATASETS]
+    return {
+        'type_hierarchy': {
+            'key': 'type',
+            'version': 1,
+            'columns': [('depth', 'int64'), ('num_siblings', 'int64'),
+                        ('num_children', 'int64')],
+            'inputs': [TYPE_HIERARCHY],
+            'compute': lambda: compute_type_hierarchy(load_type_hierarchy()),
+        },
+        'type_length': {
+            'key': 'type',
+            'version': 1,
+            'columns': [('doc_length_body', 'int64')],
+            'index': ('short', True),
+            'inputs': [stats_all],
+            'compute': lambda: compute_type_length(load_index_statistics()),
+        },
+        'type_label_idf': {
+            'key': 'type',
+            'version': 1,
+            'columns': IDF_COLUMNS,
+            'index': ('short', True),
+            'inputs': [stats_all],
+            'compute': lambda: compute_type_label_idf(load_index_statistics()),
+        },
+        'type_query_idf': {
+            'key': 'query',
+            'version': 1,
+            'columns': IDF_COLUMNS,
+            'index': ('short', True),
+            'inputs': [stats_all, *datasets],
+            'compute': lambda: compute_query_idf(load_index_statistics(),
+                                                 load_queries()),
+        },
+        'query_type_idf': {
+            'key': 'query',
+            'version': 1,
+            'columns': IDF_COLUMNS,
+            'index': ('short', False),
+            'inputs': [stats, *datasets],
+            'compute': lambda: compute_query_idf(
+                load_index_statistics('short', False), load_queries()),
+        },
+    }
+
+
+#%% STORAGE
+class FeatureTable:
+    """Columnar feature table with one row per type or query."""
+
+    def __init__(self, name, keys, columns, values):
+        self.name = name
+        self.keys = keys
+        self.columns = columns
+        self.values = values
+        self._index = {k: i for i, k in enumerate(keys)}
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self, key, default=0):
+        """Returns the feature vector of a key in schema order."""
+        if key not in self._index:
+            return [default] * len(self.columns)
+        return self.values[self._index[key]].tolist()
+
+
+def save_feature_table(name, keys, columns, schema):
+    arrays = {'__key__': np.array(keys, dtype=str)}
+    for column, dtype in schema:
+        arrays[column] = np.asarray(columns[column], dtype=dtype)
+    os.makedirs(get_data_path(FEATURE_DIR), exist_ok=True)
+    np.savez(get_data_path(os.path.join(FEATURE_DIR, name + '.npz')),
+             **arrays)
+    artifacts.clear_feature_table(name)
+
+
+def load_feature_table(name):
+    schema = load_dict_from_json(SCHEMA_FILE)
+    if not schema or name not in schema:
+        raise FileNotFoundError(
+            f'Feature table \'{name}\' has not been built, run '
+            'import_legacy_features() or build_features() first')
+
+    columns = [c for c, _ in schema[name]['columns']]
+    with np.load(get_data_path(os.path.join(FEATURE_DIR, name + '.npz')),
+                 allow_pickle=False) as table:
+        keys = table['__key__'].tolist()
+        values = np.column_stack([table[c] for c in columns]).astype(float)
+    return FeatureTable(name, keys, columns, values)
+
+
+#%% LEGACY FEATURES
+LEGACY_FILES = {
+    'type_hierarchy': 'type_hierarchy_features.json',
+    'type_length': 'type_length_features.json',
+    'type_label_idf': 'type_label_idf_features.json',
+    'type_query_idf': 'type_query_idf_features.json',
+    'query_type_idf': 'query_type_idf_features.json',
+}
+
+
+def read_legacy_features(name):
+    """Reads one of the shipped feature JSON files into (keys, columns).
+
+    Values are picked by column name, so the result does not depend on the
+    order of the nested dicts. Entries without features (queries that were
+    empty after preprocessing) get zeros.
+    """
+    doc = load_dict_from_json(LEGACY_FILES[name])
+    keys = list(doc)
+    if name == 'type_hierarchy':
+        return keys, {
+            'depth': [doc[t]['depth'] for t in keys],
+            'num_siblings': [len(doc[t]['siblings']) for t in keys],
+            'num_children': [len(doc[t]['children']) for t in keys],
+        }
+    if name == 'type_length':
+        return keys, {'doc_length_body': [doc[t] for t in keys]}
+
+    rows = [doc[k].get('X', doc[k]) for k in keys]
+    return keys, {c: [row.get(c, 0) for row in rows] for c, _ in IDF_COLUMNS}
+
+
+def import_legacy_features(names=None, force=False):
+    """Imports the shipped feature JSON files as feature tables.
+
+    Only tables that have not been built yet are imported, unless `force`
+    is set. The imported tables are marked as legacy, so `build_features`
+    replaces them when it is run.
+
+    Returns:
+        list: Names of the imported feature tables.
+    """
+    specs = get_feature_specs()
+    schema = load_dict_from_json(SCHEMA_FILE) or {}
+    imported = []
+    for name in names or LEGACY_FILES:
+        output = get_data_path(os.path.join(FEATURE_DIR, name + '.npz'))
+        if not force and name in schema and os.path.exists(output):
+            continue
+
+        print(f'Importing feature table {name} from {LEGACY_FILES[name]}.')
+        keys, columns = read_legacy_features(name)
+        save_feature_table(name, keys, columns, specs[name]['columns'])
+        schema[name] = {
+            'key': specs[name]['key'],
+            'columns': specs[name]['columns'],
+            'rows': len(keys),
+            'definition': 'legacy',
+            'inputs': get_fingerprints([get_data_path(LEGACY_FILES[name])]),
+        }
+        imported.append(name)
+
+    save_dict_to_json(schema, SCHEMA_FILE)
+    return imported
+
+
+def compare_with_legacy(names=None, rtol=1e-6):
+    """Compares freshly computed features with the shipped feature JSONs.
+
+    The pretrained model (saved_models/ltr_unlim_2) was trained on the
+    shipped values. Use it with the tables from `import_legacy_features`,
+    and retrain it before switching to rebuilt tables. Expected differences:
+
+    - type_hierarchy should match exactly.
+    - type_length, type_label_idf and type_query_idf differ for types
+      without a body. The legacy notebook filled them through a stale loop
+      variable, so they all got the children or siblings of one unrelated
+      type. For example, dbo:Sound and dbo:Document both have length 61.
+      Here each type gets its own children or siblings. The filled
+      documents change the document frequencies and N, so most IDF values
+      shift slightly as well.
+    - query_type_idf was computed from an index version that is not
+      recorded; it is rebuilt from the TC index without ancestors.
+
+    Needs the index statistics, see `build_features`.
+
+    Returns:
+        dict: For each table, the keys missing on either side and, per
+            column, the number of differing keys and the largest difference.
+    """
+    specs = get_feature_specs()
+    report = {}
+    for name in names or LEGACY_FILES:
+        keys, columns = specs[name]['compute']()
+        legacy_keys, legacy_columns = read_legacy_features(name)
+        index = {k: i for i, k in enumerate(keys)}
+        legacy_index = {k: i for i, k in enumerate(legacy_keys)}
+        shared = [k for k in legacy_keys if k in index]
+        rows = [index[k] for k in shared]
+        legacy_rows = [legacy_index[k] for k in shared]
+
+        stats = {
+            'missing': len(legacy_keys) - len(shared),
+            'extra': len(keys) - len(shared),
+            'columns': {},
+        }
+        for column, _ in specs[name]['columns']:
+            new = np.asarray(columns[column], dtype=float)[rows]
+            old = np.asarray(legacy_columns[column], dtype=float)[legacy_rows]
+            differs = ~np.isclose(new, old, rtol=rtol)
+            diff = np.abs(new - old)
+            stats['columns'][column] = {
+                'differing': int(differs.sum()),
+                'max_abs_diff': float(diff.max()) if shared else 0.0,
+                'examples': [shared[i] for i in np.flatnonzero(differs)[:5]],
+            }
+        report[name] = stats
+    return report
+
+
+def print_parity_report(report):
+    for name, stats in report.items():
+        print(f'{name}: {stats["missing"]} missing, {stats["extra"]} extra')
+        for column, col in stats['columns'].items():
+            print('  {:<18} {:>6} differ, max |diff| {:.6g}  {}'.format(
+                column, col['differing'], col['max_abs_diff'],
+                ', '.join(col['examples'])))
+
+
+#%% BUILD
+def is_outdated(entry, inputs, output, definition):
+    if not entry or not os.path.exists(output):
+        return True
+    return (entry.get('definition') != definition
+            or entry['inputs'] != get_fingerprints(inputs))
+
+
+def update_index_statistics(schema, doc_body='short', ancestors=True,
+                            force=False):
+    name = get_index_name(doc_body, ancestors)
+    output = get_data_path(os.path.join(FEATURE_DIR, name + '.npz'))
+    inputs = [get_data_path(f'document_{name}.json'), TYPE_HIERARCHY]
+    definition = str(INDEX_STATISTICS_VERSION)
+    if not force and not is_outdated(schema.get(name), inputs, output,
+                                     definition):
+        return False
+
+    print(f'Computing index statistics for {name}.')
+    documents = get_TC_documents(doc_body, ancestors)
+    with instrumentation.timer('index_statistics') as stage:
+        stats = compute_index_statistics(documents, load_type_hierarchy())
+        stage.add(len(documents))
+    os.makedirs(get_data_path(FEATURE_DIR), exist_ok=True)
+    np.savez(output, **stats)
+    schema[name] = {
+        'definition': definition,
+        'inputs': get_fingerprints(inputs),
+    }
+    return True
+
+
+def build_features(names=None, force=False):
+    """Recomputes the feature tables whose inputs or definition changed.
+
+    Args:
+        names (list, optional): Feature tables to build. Defaults to all.
+        force (bool, optional): Recompute even if inputs are unchanged.
+
+    Returns:
+        list: Names of the recomputed feature tables.
+    """
+    specs = get_feature_specs()
+    schema = load_dict_from_json(SCHEMA_FILE) or {}
+    built, indices = [], set()
+    for name in names or specs:
+        spec = specs[name]
+        if 'index' in spec and spec['index'] not in indices:
+            update_index_statistics(schema, *spec['index'], force=force)
+            indices.add(spec['index'])
+
+        output = get_data_path(os.path.join(FEATURE_DIR, name + '.npz'))
+        definition = get_spec_fingerprint(spec)
+        if not force and not is_outdated(schema.get(name), spec['inputs'],
+                                         output, definition):
+            continue
+
+        print(f'Computing feature table {name}.')
+        with instrumentation.timer(f'features.{name}') as stage:
+            keys, columns = spec['compute']()
+            stage.add(len(keys))
+        save_feature_table(name, keys, columns, spec['columns'])
+        schema[name] = {
+            'key': spec['key'],
+            'columns': spec['columns'],
+            'rows': len(keys),
+            'definition': definition,
+            'inputs': get_fingerprints(spec['inputs']),
+        }
+        save_dict_to_json(schema, SCHEMA_FILE)
+        built.append(name)
+
+    save_dict_to_json(schema, SCHEMA_FILE)
+    return built
+
+
+if __name__ == "__main__":
+    build_features()
@@ -0,0 +1,242 @@
+#%%
+"""Timers and counters for ingest, retrieval and ranking.
+
+Instrumentation is off by default and costs a flag check when disabled.
+Turn it on with `enable()` or by setting the environment variable
+SMART_PROFILE=1, in which case a summary is printed when the run ends.
+Progress reporting of long stages is independent of this and on by default;
+turn it off with `set_progress(False)` or SMART_PROGRESS=0.
+"""
+import atexit, json, os, time, tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+_enabled = False
+_progress = os.environ.get('SMART_PROGRESS') != '0'
+_profile = {}
+_summary_registered = False
+
+
+class Stage:
+    """Accumulated timings of one instrumented stage."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.items = 0
+        self.peak_memory = 0
+        self.profiler = None
+
+    def add(self, items=1):
+        """Counts processed items (documents, queries, ...) for throughput."""
+        self.items += items
+
+    def to_dict(self):
+        return {
+            'calls': self.calls,
+            'seconds': self.seconds,
+            'max_seconds': self.max_seconds,
+            'items': self.items,
+            'items_per_second':
+                self.items / self.seconds if self.seconds else 0.0,
+            'peak_memory_bytes': self.peak_memory,
+        }
+
+
+class _NullStage:
+
+    def add(self, items=1):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+_stages = defaultdict(Stage)
+_counters = defaultdict(int)
+
+
+#%% CONTROL
+def enable(profile=None, summary=True):
+    """Turns instrumentation on.
+
+    Args:
+        profile (dict, optional): Maps stage names to 'cprofile' or
+            'tracemalloc' to profile those stages.
+        summary (bool, optional): Print a summary table at exit.
+    """
+    global _enabled, _summary_registered
+    _enabled = True
+    _profile.update(profile or {})
+    if summary and not _summary_registered:
+        atexit.register(print_summary)
+        _summary_registered = True
+
+
+def disable():
+    global _enabled
+    _enabled = False
+_progress = os.environ.get('SMART_PROGRESS') != '0'
+
+
+def is_enabled():
+    return _enabled
+
+
+def set_progress(enabled=True):
+    """Turns progress reporting of long stages on or off."""
+    global _progress
+    _progress = enabled
+
+
+def reset():
+    _stages.clear()
+    _counters.clear()
+
+
+#%% RECORDING
+@contextmanager
+def timer(name):
+    """Times a stage. Yields the stage so the block can count items."""
+    if not _enabled:
+        yield _NULL_STAGE
+        return
+
+    stage = _stages[name]
+    mode = _profile.get(name)
+    if mode == 'cprofile':
+        import cProfile
+        stage.profiler = stage.profiler or cProfile.Profile()
+        stage.profiler.enable()
+    elif mode == 'tracemalloc':
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    start = time.perf_counter()
+    try:
+        yield stage
+    finally:
+        elapsed = time.perf_counter() - start
+        if mode == 'cprofile':
+            stage.profiler.disable()
+        elif mode == 'tracemalloc':
+            peak = tracemalloc.get_traced_memory()[1] - start_memory
+            stage.peak_memory = max(stage.peak_memory, peak)
+        stage.calls += 1
+        stage.seconds += elapsed
+        stage.max_seconds = max(stage.max_seconds, elapsed)
+
+
+def timed(name):
+    """Decorator version of `timer`, counting each call as one item."""
+
+    def decorator(func):
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name) as stage:
+                stage.add()
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """Increments a counter such as 'es_requests' or 'bytes_read'."""
+    if _enabled:
+        _counters[name] += value
+
+
+def progress(name, done, total, step=10):
+    """Prints the progress of a stage every `step` percent.
+
+    Args:
+        name (str): Stage name.
+        done (int): Number of items processed so far, counting from 1.
+        total (int): Total number of items.
+        step (int, optional): Reporting interval in percent. Defaults to 10.
+    """
+    if not _progress or not total:
+        return
+    percent = done * 100 // total
+    if done == 1 or percent // step != (done - 1) * 100 // total // step:
+        print(f'{name}: {percent}% done ({done}/{total})')
+
+
+#%% REPORTING
+def get_report():
+    return {
+        'stages': {name: s.to_dict() for name, s in _stages.items()},
+        'counters': dict(_counters),
+    }
+
+
+def to_prometheus():
+    lines = []
+    metrics = [('calls', 'calls_total'), ('seconds', 'seconds_total'),
+               ('items', 'items_total'),
+               ('peak_memory_bytes', 'peak_memory_bytes')]
+    report = get_report()
+    for key, metric in metrics:
+        kind = 'gauge' if key == 'peak_memory_bytes' else 'counter'
+        lines.append(f'# TYPE smart_stage_{metric} {kind}')
+        for name, stats in report['stages'].items():
+            lines.append(
+                f'smart_stage_{metric}{{stage="{name}"}} {stats[key]}')
+    for name, value in report['counters'].items():
+        lines.append(f'# TYPE smart_{name}_total counter')
+        lines.append(f'smart_{name}_total {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def save_report(filename):
+    """Saves the report as Prometheus text (.prom) or JSON (anything else)."""
+    with open(filename, 'w') as f:
+        if filename.endswith('.prom'):
+            f.write(to_prometheus())
+        else:
+            json.dump(get_report(), f, indent=2)
+
+
+def save_profiles(dirname='profiles'):
+    """Dumps the cProfile statistics of each profiled stage to a file."""
+    os.makedirs(dirname, exist_ok=True)
+    for name, stage in _stages.items():
+        if stage.profiler is not None:
+            stage.profiler.dump_stats(os.path.join(dirname, f'{name}.prof'))
+
+
+def print_summary(top=10):
+    if not _stages and not _counters:
+        return
+
+    print('{:<28} {:>8} {:>10} {:>10} {:>10} {:>12}'.format(
+        'stage', 'calls', 'total [s]', 'max [s]', 'items', 'items/s'))
+    for name, stats in sorted(get_report()['stages'].items(),
+                              key=lambda x: x[1]['seconds'],
+                              reverse=True):
+        print('{:<28} {:>8} {:>10.3f} {:>10.3f} {:>10} {:>12.1f}'.format(
+            name, stats['calls'], stats['seconds'], stats['max_seconds'],
+            stats['items'], stats['items_per_second']))
+        if stats['peak_memory_bytes']:
+            print('{:<28} peak memory {:.1f} MiB'.format(
+                '', stats['peak_memory_bytes'] / 2**20))
+    for name, value in _counters.items():
+        print(f'{name}: {value}')
+
+    for name, stage in _stages.items():
+        if stage.profiler is not None:
+            import io, pstats
+            out = io.StringIO()
+            pstats.Stats(stage.profiler, stream=out).sort_stats(
+                'cumulative').print_stats(top)
+            print(f'\nProfile of {name}:\n{out.getvalue()}')
+
+
+if os.environ.get('SMART_PROFILE') == '1':
+    enable()
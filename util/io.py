@@ -1,6 +1,8 @@
 import os
 import json
 
+from util import instrumentation
+
 
 def get_data_path(filename, dbpedia=False):
     return os.path.join(os.getcwd(), 'data', 'dbpedia' if dbpedia else '',
@@ -14,8 +16,10 @@ def save_dict_to_json(doc, filename):
 
 def load_dict_from_json(filename):
     try:
-        with open(get_data_path(filename), 'r') as f:
+        path = get_data_path(filename)
+        with instrumentation.timer('load_json'), open(path, 'r') as f:
             doc = json.load(f)
+        instrumentation.count('bytes_read', os.path.getsize(path))
         return doc
     except:
         print(f'File \'{filename}\' not found.')
@@ -1,17 +1,24 @@
 import os, json, string
 from collections import defaultdict
-from nltk.corpus import stopwords
+from functools import lru_cache
 
+from util import instrumentation
 from util.io import get_data_path, load_dict_from_json, save_dict_to_json
 
-STOPWORDS = stopwords.words('english')
-
 
 #%% PREPROCESS TEXT
+@lru_cache(maxsize=None)
+def get_stopwords():
+    """Loads the NLTK English stopwords on first use."""
+    from nltk.corpus import stopwords
+    return frozenset(stopwords.words('english'))
+
+
 def process(text):
+    stopwords = get_stopwords()
     text = text.replace('\'', '')
     text = ''.join(ch if ch not in string.punctuation else ' ' for ch in text)
-    text = ' '.join(word for word in text.split(' ') if word not in STOPWORDS)
+    text = ' '.join(word for word in text.split(' ') if word not in stopwords)
     return text
 
 
@@ -267,14 +274,15 @@ def get_TC_documents(doc_body='anchor', ancestors=False, force=False):
     print('Creating new document.')
     bodies = get_document_bodies(doc_body)
     type_entities = get_type_entity(ancestors)
-    num_types = len(type_entities)
 
     document = defaultdict(dict)
-    for i, (t, entities) in enumerate(type_entities.items()):
-        print(
-            f'Processing {i+1}/{num_types} type with {len(entities)} entities')
-        document[t]['body'] = ' '.join(
-            bodies.get(entity, '') for entity in entities)
+    with instrumentation.timer('build_TC_documents') as stage:
+        for i, (t, entities) in enumerate(type_entities.items(), 1):
+            document[t]['body'] = ' '.join(
+                bodies.get(entity, '') for entity in entities)
+            stage.add(len(entities))
+            instrumentation.progress('build_TC_documents', i,
+                                     len(type_entities))
 
     save_dict_to_json(document, filename)
     return document
@@ -0,0 +1,244 @@
+#%%
+import os, time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+try:
+    from sklearn.ensemble import HistGradientBoostingRegressor
+except ImportError:
+    from sklearn.experimental import enable_hist_gradient_boosting
+    from sklearn.ensemble import HistGradientBoostingRegressor
+
+from util import instrumentation
+from util.io import get_data_path, load_dict_from_json, save_dict_to_json
+from util.features import TYPE_HIERARCHY
+from smart_dataset.evaluation.dbpedia.evaluate import load_type_hierarchy, evaluate
+
+CACHE_DIR = 'ltr_cache'
+
+SEARCH_SPACE = [
+    (RandomForestRegressor(), {
+        'max_depth': [2, 4, 8],
+        'n_estimators': [100, 300, 1000],
+    }),
+    (HistGradientBoostingRegressor(), {
+        'max_depth': [None, 3, 6],
+        'learning_rate': [0.05, 0.1],
+        'max_iter': [100, 300],
+    }),
+]
+
+
+#%% FEATURE CACHE
+def assemble_feature_matrix(queries, get_types, extract):
+    """Extracts features for every candidate type of every query.
+
+    Args:
+        queries (list): Queries with 'id' and 'type' keys.
+        get_types (callable): Returns the candidate types of a query.
+        extract (callable): Returns the feature vector for (qid, type).
+
+    Returns:
+        dict: Feature matrix 'X', labels 'y', query group 'offsets' into the
+            rows of X, and the 'qids', row 'types' and 'relevant' types.
+    """
+    X, y, offsets, qids, types = [], [], [0], [], []
+    with instrumentation.timer('assemble_feature_matrix') as stage:
+        for query in queries:
+            for t in get_types(query):
+                X.append(extract(query['id'], t))
+                y.append(1 if t in query['type'] else 0)
+                types.append(t)
+            qids.append(query['id'])
+            offsets.append(len(X))
+        stage.add(len(X))
+
+    return {
+        'X': np.asarray(X, dtype=np.float64),
+        'y': np.asarray(y, dtype=np.float64),
+        'offsets': np.asarray(offsets, dtype=np.int64),
+        'qids': qids,
+        'types': types,
+        'relevant': {q['id']: q['type'] for q in queries},
+    }
+
+
+def save_feature_cache(name, data):
+    path = get_data_path(os.path.join(CACHE_DIR, name))
+    os.makedirs(path, exist_ok=True)
+    for key in ('X', 'y', 'offsets'):
+        np.save(os.path.join(path, key + '.npy'), data[key])
+    save_dict_to_json({k: data[k] for k in ('qids', 'types', 'relevant')},
+                      os.path.join(CACHE_DIR, name, 'meta.json'))
+
+
+def load_feature_cache(name):
+    """Loads a cached feature matrix, memory-mapping the arrays."""
+    meta = load_dict_from_json(os.path.join(CACHE_DIR, name, 'meta.json'))
+    if not meta:
+        return None
+
+    path = get_data_path(os.path.join(CACHE_DIR, name))
+    for key in ('X', 'y', 'offsets'):
+        meta[key] = np.load(os.path.join(path, key + '.npy'), mmap_mode='r')
+    return meta
+
+
+def get_feature_cache(name, queries, get_types, extract, force=False):
+    """Loads the feature cache `name`, assembling and saving it if needed.
+
+    The cache is not invalidated automatically; pass `force=True` after the
+    features or the candidate selection change.
+    """
+    if not force:
+        data = load_feature_cache(name)
+        if data:
+            return data
+
+    print(f'Assembling feature matrix \'{name}\'.')
+    save_feature_cache(name, assemble_feature_matrix(queries, get_types,
+                                                     extract))
+    return load_feature_cache(name)
+
+
+#%% EVALUATION
+def rank_groups(scores, data):
+    """Ranks the candidate types of each query by predicted score."""
+    rankings = {}
+    offsets = data['offsets']
+    for i, qid in enumerate(data['qids']):
+        start, end = offsets[i], offsets[i + 1]
+        order = np.argsort(scores[start:end])[::-1]
+        rankings[qid] = [data['types'][start + j] for j in order]
+    return rankings
+
+
+def top1_accuracy(rankings, data):
+    """Fraction of queries whose top ranked type is relevant."""
+    hits, num_queries = 0, 0
+    for qid, relevant in data['relevant'].items():
+        if not relevant:
+            continue
+        num_queries += 1
+        if rankings.get(qid) and rankings[qid][0] in relevant:
+            hits += 1
+    return hits / max(num_queries, 1)
+
+
+def evaluate_rankings(rankings, data, type_hierarchy, max_depth):
+    """Scores type rankings with the SMART evaluator.
+
+    Every query is scored as a resource query, so only the NDCG scores of
+    the evaluator are meaningful here.
+    """
+    system_output, ground_truth = {}, {}
+    for qid, relevant in data['relevant'].items():
+        relevant = [t for t in relevant if t in type_hierarchy]
+        if not relevant:
+            continue
+        ground_truth[qid] = {'category': 'resource', 'type': relevant}
+        system_output[qid] = {
+            'category': 'resource',
+            'type': [t for t in rankings.get(qid, []) if t in type_hierarchy]
+        }
+    return evaluate(system_output, ground_truth, type_hierarchy, max_depth)
+
+
+#%% MODEL SEARCH
+def _fit_and_score(estimator, params, train, validation, type_hierarchy,
+                   max_depth):
+    model = clone(estimator).set_params(**params)
+
+    start = time.perf_counter()
+    model.fit(train['X'], train['y'])
+    train_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    scores = model.predict(validation['X'])
+    rankings = rank_groups(scores, validation)
+    inference_time = time.perf_counter() - start
+
+    ev = evaluate_rankings(rankings, validation, type_hierarchy, max_depth)
+    return {
+        'model': type(model).__name__,
+        'params': params,
+        'train_time': train_time,
+        'inference_ms_per_query':
+            1000 * inference_time / max(len(validation['qids']), 1),
+        'Top1': top1_accuracy(rankings, validation),
+        'NDCG5': ev['NDCG5'],
+        'NDCG10': ev['NDCG10'],
+        'estimator': model,
+        'serial_timing': False,
+    }
+
+
+def search_models(train,
+                  validation,
+                  search_space=SEARCH_SPACE,
+                  n_iter=None,
+                  n_jobs=-1,
+                  random_state=0,
+                  retime=3):
+    """Fits every configuration on `train` and scores it on `validation`.
+
+    With `n_jobs` other than 1, the configurations run in parallel workers
+    that compete for the CPU, so their train and inference times are
+    inflated and not comparable. The best `retime` configurations are
+    therefore fitted again one at a time, and their timings are replaced by
+    the serial ones.
+
+    Args:
+        train (dict): Feature cache, see `get_feature_cache`.
+        validation (dict): Feature cache to rank and evaluate on.
+        search_space (list, optional): (estimator, parameter grid) tuples.
+        n_iter (int, optional): Sample this many configurations per
+            estimator instead of searching the full grid. Defaults to None.
+        n_jobs (int, optional): Number of parallel jobs. Defaults to all cores.
+        random_state (int, optional): Seed for sampling configurations.
+        retime (int, optional): Number of best configurations to time
+            serially after the search. Defaults to 3.
+
+    Returns:
+        list: One result dict per configuration, best NDCG@10 first.
+    """
+    type_hierarchy, max_depth = load_type_hierarchy(TYPE_HIERARCHY)
+
+    configs = []
+    for estimator, grid in search_space:
+        params = ParameterGrid(grid) if n_iter is None else ParameterSampler(
+            grid, n_iter, random_state=random_state)
+        configs.extend((estimator, p) for p in params)
+
+    results = Parallel(n_jobs=n_jobs)(
+        delayed(_fit_and_score)(estimator, params, train, validation,
+                                type_hierarchy, max_depth)
+        for estimator, params in configs)
+    results = sorted(results, key=lambda x: x['NDCG10'], reverse=True)
+
+    for i, res in enumerate(results):
+        if n_jobs != 1 and i < retime:
+            serial = _fit_and_score(res['estimator'], res['params'], train,
+                                    validation, type_hierarchy, max_depth)
+            res['train_time'] = serial['train_time']
+            res['inference_ms_per_query'] = serial['inference_ms_per_query']
+        res['serial_timing'] = n_jobs == 1 or i < retime
+    return results
+
+
+def print_search_results(results):
+    print('{:<32} {:>10} {:>12} {:>8} {:>8} {:>8}  {}'.format(
+        'model', 'train [s]', 'infer [ms/q]', 'Top-1', 'NDCG@5', 'NDCG@10',
+        'params'))
+    for res in results:
+        mark = ' ' if res['serial_timing'] else '*'
+        print('{:<32} {:>9.2f}{} {:>11.3f}{} {:>8.4f} {:>8.4f} {:>8.4f}  {}'.format(
+            res['model'], res['train_time'], mark,
+            res['inference_ms_per_query'], mark, res['Top1'], res['NDCG5'],
+            res['NDCG10'], res['params']))
+    if not all(res['serial_timing'] for res in results):
+        print('* timed in parallel workers under CPU contention, not '
+              'comparable to serial timings')